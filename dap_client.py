@@ -1,157 +1,597 @@
 #!/usr/bin/env python3
 
+import os
+import selectors
 import socket
+import sys
 import json
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from operator import attrgetter
+from typing import Optional
+
+HOST = os.environ.get("DAP_HOST", "127.0.0.1")
+PORT = int(os.environ.get("DAP_PORT", "5678"))
+# Optional Unix domain socket path. When set (and the platform supports
+# AF_UNIX), the DAP session skips the loopback TCP stack entirely, which
+# shaves per-message kernel overhead off the thousands of small framed
+# messages a deep variable tree produces.
+UNIX_SOCKET = os.environ.get("DAP_UNIX_SOCKET", "")
+
+log = logging.getLogger(__name__)
+
+# C-level sort key for ordering variables by name
+_by_name = attrgetter("name")
+
+# Use orjson for the per-message encode/decode hot path when available;
+# it works directly in bytes and parses with a C core. Fall back to the
+# stdlib json module if it isn't installed.
+try:
+    import orjson
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj)
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+except ImportError:
+
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    def _json_loads(data):
+        # json.loads accepts bytes directly (3.6+) but not memoryview;
+        # the bytes() here is the single copy on this fallback path
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+# How many bytes to pull from the socket per recv call
+RECV_CHUNK = 65536
+
+# How long to wait for the server to become readable before giving up
+READ_TIMEOUT = 10.0
+
+# Upper bound on the bytes of pipelined "variables" requests sent before
+# draining their responses. An unbounded level (levels grow
+# multiplicatively) could fill both sides' socket buffers — the server
+# blocks writing responses we aren't reading, stops reading, and our
+# blocking sendall never returns. Staying well under the 1MB buffers
+# keeps the pipeline deadlock-free while preserving the round-trip win.
+MAX_BATCH_BYTES = 262144
+
+# Page size for "variables" requests against large indexed collections,
+# and the cap on how many elements of one collection we fetch at all.
+# Anything past the cap is marked "truncated" on the parent item.
+PAGE_SIZE = 200
+MAX_CHILDREN = 1000
+
+# Variables to filter out of the tree entirely. These tend to be
+# boilerplate or internal variables that are not interesting to display,
+# and some (__builtins__ especially) expand to hundreds of entries, so
+# skipping them before the fetch also cuts a lot of DAP traffic.
+VARIABLE_NAMES_TO_FILTER = frozenset(
+    {
+        "__builtins__",
+        "__doc__",
+        "__loader__",
+        "__name__",
+        "__package__",
+        "__spec__",
+        "special variables",
+        "function variables",
+        "module variables",
+        "class variables",
+        "debugpy",
+    }
+)
+VARIABLE_TYPES_TO_FILTER = frozenset(
+    {
+        "builtin_function_or_method",
+        "method-wrapper",
+    }
+)
+
 
-HOST = "127.0.0.1"
-PORT = 5678
+@dataclass(slots=True)
+class Variable:
+    """
+    One fetched variable. Slots keep the per-node footprint a fraction
+    of the equivalent six-key dict, which matters when deep trees hold
+    tens of thousands of nodes.
+    """
 
+    name: str
+    value: str
+    type: str
+    evaluateName: Optional[str]
+    variablesReference: int
+    children: list = field(default_factory=list)
+    truncated: bool = False
+
+    def as_dict(self):
+        """Shallow plain-dict view, for JSON serialization."""
+        return {
+            "name": self.name,
+            "value": self.value,
+            "type": self.type,
+            "evaluateName": self.evaluateName,
+            "variablesReference": self.variablesReference,
+            "truncated": self.truncated,
+            "children": self.children,
+        }
 
-def read_line(sock):
-    """Reads a single line (terminated by \n) from the socket, stripping \r\n."""
-    buf = []
-    while True:
-        chunk = sock.recv(1)
-        if not chunk:
-            raise ConnectionError("Socket closed while reading line.")
-        if chunk == b"\n":
-            break
-        buf.append(chunk)
-    line = b"".join(buf).rstrip(b"\r")
-    return line.decode("utf-8")
-
-
-def read_exactly(sock, n):
-    """Reads exactly n bytes from the socket."""
-    data = b""
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
-            raise ConnectionError("Socket closed unexpectedly.")
-        data += chunk
-    return data
-
-
-def read_dap_message(sock):
+
+class DapReader:
     """
-    Reads and returns one DAP message from the socket as a Python dict.
+    Buffered reader for the DAP socket.
+
+    Pulls RECV_CHUNK bytes per recv into an internal buffer and serves
+    header lines and message bodies from it, instead of issuing one
+    recv syscall per byte.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buf = bytearray()
+        self._scratch = bytearray(RECV_CHUNK)
+        # Reusable body buffer; grows to the largest message seen and is
+        # never shrunk, so steady-state reads allocate nothing.
+        self._body_buf = bytearray()
+        # Registered once; epoll-backed on Linux, so waiting for data
+        # doesn't rebuild fd lists on every call like select.select does
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ)
+
+    def _wait_readable(self):
+        """
+        Blocks until the socket has data, or raises TimeoutError. The
+        socket itself stays in blocking mode (the client runs in a task
+        thread, so the UI's event loop is never behind these reads);
+        the selector just enforces the deadline.
+        """
+        if not self._selector.select(READ_TIMEOUT):
+            raise TimeoutError("No data from DAP server within %s seconds" % READ_TIMEOUT)
+
+    def _fill(self):
+        """Reads one chunk from the socket into the internal buffer."""
+        self._wait_readable()
+        n = self.sock.recv_into(self._scratch)
+        if not n:
+            raise ConnectionError("Socket closed while reading.")
+        self._buf += memoryview(self._scratch)[:n]
+
+    def read_headers(self):
+        """
+        Reads one raw header block, up to (and consuming) the blank line
+        that terminates it. Returns the block as bytes.
+        """
+        while True:
+            idx = self._buf.find(b"\r\n\r\n")
+            if idx >= 0:
+                break
+            self._fill()
+        block = bytes(self._buf[:idx])
+        del self._buf[: idx + 4]
+        return block
+
+    def read_exact_view(self, n):
+        """
+        Reads exactly n bytes and returns them as a memoryview into the
+        pooled body buffer, valid only until the next read call. Any
+        remainder beyond what's buffered is recv'd straight into place,
+        so nothing is copied more than once on the way to the parser.
+        """
+        if len(self._body_buf) < n:
+            self._body_buf.extend(b"\0" * (n - len(self._body_buf)))
+        mv = memoryview(self._body_buf)[:n]
+        got = min(len(self._buf), n)
+        mv[:got] = memoryview(self._buf)[:got]
+        del self._buf[:got]
+        while got < n:
+            self._wait_readable()
+            k = self.sock.recv_into(mv[got:])
+            if not k:
+                raise ConnectionError("Socket closed unexpectedly.")
+            got += k
+        return mv
+
+
+def read_dap_message(reader):
+    """
+    Reads and returns one DAP message from the reader as a Python dict.
     Raises ConnectionError if the socket is closed or data is invalid.
     """
-    headers = {}
-    while True:
-        line = read_line(sock)
-        if line == "":
-            # Empty line -> end of headers
-            break
-        if ":" in line:
-            k, v = line.split(":", 1)
-            headers[k.strip().lower()] = v.strip()
+    block = reader.read_headers()
 
-    length_str = headers.get("content-length")
-    if not length_str:
-        raise ConnectionError("No Content-Length header in DAP message.")
+    # Fast path: in practice the only header DAP sends is Content-Length,
+    # so grab the number straight out of the block.
+    if block.startswith(b"Content-Length:"):
+        end = block.find(b"\r", 15)
+        length = int(block[15:] if end < 0 else block[15:end])
+    else:
+        length = _parse_content_length(block)
 
-    length = int(length_str)
-    raw_json = read_exactly(sock, length)
-    return json.loads(raw_json.decode("utf-8"))
+    raw_json = reader.read_exact_view(length)
+    return _json_loads(raw_json)
+
+
+def _parse_content_length(block):
+    """
+    Full header parse, for the rare case of extra or reordered headers.
+    DAP headers are ASCII, so everything stays at the bytes level:
+    bytes.lower() is a straight C loop with no Unicode case folding,
+    and nothing gets decoded or stored in a dict.
+    """
+    for line in block.split(b"\r\n"):
+        name, sep, value = line.partition(b":")
+        if sep and name.strip().lower() == b"content-length":
+            return int(value)
+
+    raise ConnectionError("No Content-Length header in DAP message.")
+
+
+def _connect():
+    """
+    Connects to the DAP server, preferring the Unix domain socket when
+    one is configured. Framing is byte-oriented so everything else works
+    the same over either transport.
+    """
+    if UNIX_SOCKET and hasattr(socket, "AF_UNIX"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(UNIX_SOCKET)
+    else:
+        sock = socket.create_connection((HOST, PORT))
+        # Disable Nagle: DAP traffic is lots of tiny framed requests, and
+        # letting the kernel coalesce them adds delayed-ACK stalls per send.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # Ask for 1MB kernel buffers so a big variables response (or a whole
+    # pipelined level of requests) isn't throttled by the default sizes
+    for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, 1 << 20)
+        except OSError:
+            pass
+    return sock
+
+
+# Shared empty-arguments dict; the serializer only reads it, so there's
+# no need to allocate a fresh one per argument-less request
+_EMPTY_ARGS = {}
 
 
 def send_dap_request(sock, seq, command, arguments=None):
     """Sends a DAP request. Returns the new seq (seq+1)."""
     if arguments is None:
-        arguments = {}
+        arguments = _EMPTY_ARGS
     request = {
         "seq": seq,
         "type": "request",
         "command": command,
         "arguments": arguments,
     }
-    payload = json.dumps(request).encode("utf-8")
-    header = f"Content-Length: {len(payload)}\r\n\r\n".encode("utf-8")
-    sock.sendall(header + payload)
+    _send_framed(sock, _json_dumps(request))
     return seq + 1
 
 
-def fetch_variables(sock, seq, var_ref):
+def _send_framed(sock, payload):
     """
-    Fetches the immediate children for the given variablesReference (single DAP "variables" request).
-    Returns (updated_seq, list_of_variable_dicts).
+    Frames the payload with a Content-Length header and sends it.
+
+    Header and payload always leave in a single write (sendmsg or a
+    concatenated sendall), so with TCP_NODELAY set each request goes out
+    as one segment; there is no split write for TCP_CORK to paper over.
+    """
+    header = b"Content-Length: %d\r\n\r\n" % len(payload)
+    if hasattr(sock, "sendmsg"):
+        # Vectored send: header + payload in one syscall, no concat copy
+        sent = sock.sendmsg([header, payload])
+        if sent < len(header) + len(payload):
+            # Rare partial send; push out the remainder
+            sock.sendall((header + payload)[sent:])
+    else:
+        sock.sendall(header + payload)
+
+
+def _static_request_template(command, arguments):
     """
-    seq = send_dap_request(sock, seq, "variables", {"variablesReference": var_ref})
+    Pre-serializes a request whose arguments never change, leaving a %d
+    slot for the seq field to be patched in at send time.
+    """
+    args_json = _json_dumps(arguments).replace(b"%", b"%%")
+    return (
+        b'{"seq":%d,"type":"request","command":"'
+        + command.encode("ascii")
+        + b'","arguments":'
+        + args_json
+        + b"}"
+    )
 
-    variables_response = None
-    while variables_response is None:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "variables":
-            variables_response = msg
-        else:
-            print("Got message (waiting for variables):", msg)
 
-    vars_body = variables_response.get("body", {})
-    variables_list = vars_body.get("variables", [])
-    return seq, variables_list
+# The boot-time requests always carry the same arguments, so their JSON
+# is built once at import instead of on every run.
+_INITIALIZE_TEMPLATE = _static_request_template(
+    "initialize",
+    {
+        "adapterID": "debugpy-test",
+        "pathFormat": "path",
+        "linesStartAt1": True,
+        "columnsStartAt1": True,
+        "supportsVariableType": True,
+        "supportsVariablePaging": True,
+        "supportsRunInTerminalRequest": False,
+    },
+)
+_ATTACH_TEMPLATE = _static_request_template("attach", {"subProcess": False})
+_CONFIG_DONE_TEMPLATE = _static_request_template("configurationDone", {})
+
+
+def send_static_request(sock, seq, template):
+    """Sends a precomputed request template. Returns the new seq (seq+1)."""
+    _send_framed(sock, template % seq)
+    return seq + 1
 
 
-def fetch_variable_tree(sock, seq, var_ref, depth, visited=None):
+def wait_for_response(reader, req_seq):
     """
-    Recursively fetches a tree of variables up to 'depth' levels.
+    Reads messages until the response matching req_seq arrives and
+    returns it. Intervening events and unrelated messages are logged
+    at debug level and skipped.
+    """
+    while True:
+        msg = read_dap_message(reader)
+        if msg.get("type") == "response" and msg.get("request_seq") == req_seq:
+            return msg
+        log.debug("Got message (waiting for response %d): %r", req_seq, msg)
 
-    Each returned item is a dict:
-    {
-      "name": str,
-      "value": str,
-      "type": str,
-      "evaluateName": str or None,
-      "variablesReference": int,
-      "children": [...]
-    }
+
+def wait_for_event(reader, event_name):
+    """Reads messages until the named event arrives and returns it."""
+    while True:
+        msg = read_dap_message(reader)
+        if msg.get("type") == "event" and msg.get("event") == event_name:
+            return msg
+        log.debug("Got message (waiting for %r event): %r", event_name, msg)
+
+
+def fetch_variables(reader, seq, var_ref):
+    """
+    Fetches the immediate children for the given variablesReference (single DAP "variables" request).
+    Returns (updated_seq, list_of_variable_dicts).
     """
-    if visited is None:
-        visited = set()
+    seq = send_dap_request(reader.sock, seq, "variables", {"variablesReference": var_ref})
+    variables_response = wait_for_response(reader, seq - 1)
 
-    # Prevent infinite recursion on cyclical references
-    if var_ref in visited:
-        return seq, [
-            {
-                "name": "<recursive>",
-                "value": "...",
-                "type": "recursive",
-                "evaluateName": None,
-                "variablesReference": 0,
-                "children": [],
-            }
-        ]
-
-    visited.add(var_ref)
-
-    # 1) Fetch immediate child variables at this level
-    seq, vars_list = fetch_variables(sock, seq, var_ref)
-
-    result = []
-    for v in vars_list:
-        child_ref = v.get("variablesReference", 0)
-        item = {
-            "name": v["name"],
-            "value": v.get("value", ""),
-            "type": v.get("type", ""),
-            "evaluateName": v.get("evaluateName"),
-            "variablesReference": child_ref,
-            "children": [],
-        }
+    vars_body = variables_response.get("body", {})
+    variables_list = vars_body.get("variables", [])
+    return seq, variables_list
 
-        # If this variable itself has children, recurse (within depth)
-        if child_ref > 0 and depth > 0:
-            seq, child_vars = fetch_variable_tree(
-                sock, seq, child_ref, depth=depth - 1, visited=visited
-            )
-            item["children"] = child_vars
 
-        result.append(item)
+def fetch_variable_tree(reader, seq, var_ref, depth, cache=None):
+    """Single-root convenience wrapper around fetch_variable_trees."""
+    seq, trees = fetch_variable_trees(reader, seq, [var_ref], depth, cache)
+    return seq, trees[0]
 
-    return seq, result
 
+def fetch_variable_trees(reader, seq, var_refs, depth, cache=None):
+    """
+    Fetches a tree of variables up to 'depth' levels under each of
+    'var_refs', returning the trees in the same order.
+
+    Walks all the trees breadth-first together and pipelines the
+    "variables" requests for a whole level before reading any responses,
+    so the wire cost is one round trip per level instead of one per
+    variable — and passing several roots (e.g. every scope of a frame)
+    merges their walks into the same round trips.
+
+    A reference seen more than once (e.g. a module object shared by
+    several locals) is fetched once and its subtree shared, via 'cache'
+    (variablesReference -> children list). Pass the same dict across
+    calls to share subtrees between scopes too. References that recur
+    along their own ancestor chain are cut off with a "<recursive>"
+    marker during the walk; cycles that sharing assembles out of
+    disjoint paths (mutually-referencing objects) are cut the same way
+    by _break_cycles once all responses are in.
+
+    Returns (updated_seq, list_of_trees).
+    """
+    if cache is None:
+        cache = {}
+
+    # Work queue of fetches still to send: (target list, parent item,
+    # request arguments, depth budget left, ancestor refs for cycle
+    # detection).
+    queue = deque()
+    results = []
+    for var_ref in var_refs:
+        if var_ref in cache:
+            results.append(cache[var_ref])
+            continue
+        result = []
+        cache[var_ref] = result
+        results.append(result)
+        queue.append(
+            (result, None, {"variablesReference": var_ref}, depth, frozenset((var_ref,)))
+        )
 
-def dap_client(depth_limit: int):
+    # Large collections are fetched as several pages, each into its own
+    # list; (children, pages) pairs are stitched together at the end so
+    # element order doesn't depend on response order.
+    stitches = []
+
+    while queue:
+        # Frame a sub-batch of requests into one buffer and send it with
+        # a single sendall before reading anything back, capped at
+        # MAX_BATCH_BYTES so the responses are drained before either
+        # side's socket buffers can fill. Maps the seq of each in-flight
+        # request to its queue entry.
+        pending = {}
+        batch = bytearray()
+        while queue and len(batch) < MAX_BATCH_BYTES:
+            target, parent, args, depth_left, ancestors = queue.popleft()
+            payload = _json_dumps(
+                {
+                    "seq": seq,
+                    "type": "request",
+                    "command": "variables",
+                    "arguments": args,
+                }
+            )
+            batch += b"Content-Length: %d\r\n\r\n" % len(payload)
+            batch += payload
+            pending[seq] = (target, parent, depth_left, ancestors)
+            seq += 1
+        reader.sock.sendall(batch)
+
+        while pending:
+            msg = read_dap_message(reader)
+            entry = None
+            if msg.get("type") == "response":
+                entry = pending.pop(msg.get("request_seq"), None)
+            if entry is None:
+                log.debug("Got message (waiting for variables): %r", msg)
+                continue
+            target, parent, depth_left, ancestors = entry
+
+            for v in msg.get("body", {}).get("variables", []):
+                # Cap runaway nodes (dicts with thousands of named
+                # members etc.) the same way paged collections are capped
+                if len(target) >= MAX_CHILDREN:
+                    if parent is not None:
+                        parent.truncated = True
+                    break
+                # Filter before allocating anything: filtered nodes never
+                # become a Variable and are never expanded
+                if (
+                    v["name"] in VARIABLE_NAMES_TO_FILTER
+                    or v.get("type") in VARIABLE_TYPES_TO_FILTER
+                ):
+                    continue
+                child_ref = v.get("variablesReference", 0)
+                # Intern names and types: both repeat heavily across a big
+                # tree ("str", "int", dict keys of uniform objects), so one
+                # shared object serves every occurrence and set-membership
+                # checks hit on identity.
+                item = Variable(
+                    sys.intern(v["name"]),
+                    v.get("value", ""),
+                    sys.intern(v.get("type", "")),
+                    v.get("evaluateName"),
+                    child_ref,
+                )
+                target.append(item)
+
+                # If this variable itself has children, queue it for the
+                # next level (within depth)
+                if child_ref > 0 and depth_left > 0:
+                    if child_ref in ancestors:
+                        item.children = [_recursive_marker()]
+                    elif child_ref in cache:
+                        item.children = cache[child_ref]
+                    else:
+                        cache[child_ref] = item.children
+                        child_ancestors = ancestors | {child_ref}
+                        indexed = v.get("indexedVariables") or 0
+                        if indexed > PAGE_SIZE:
+                            # Page the collection instead of asking for
+                            # everything in one giant response
+                            count = indexed
+                            if count > MAX_CHILDREN:
+                                count = MAX_CHILDREN
+                                item.truncated = True
+                            pages = []
+                            for start in range(0, count, PAGE_SIZE):
+                                page = []
+                                pages.append(page)
+                                queue.append(
+                                    (
+                                        page,
+                                        item,
+                                        {
+                                            "variablesReference": child_ref,
+                                            "start": start,
+                                            "count": min(PAGE_SIZE, count - start),
+                                        },
+                                        depth_left - 1,
+                                        child_ancestors,
+                                    )
+                                )
+                            stitches.append((item.children, pages))
+                        else:
+                            queue.append(
+                                (
+                                    item.children,
+                                    item,
+                                    {"variablesReference": child_ref},
+                                    depth_left - 1,
+                                    child_ancestors,
+                                )
+                            )
+
+    for children, pages in stitches:
+        for page in pages:
+            children.extend(page)
+
+    # Sharing can have stitched the trees into a graph with cycles;
+    # break them now that every list is final.
+    _break_cycles(results)
+
+    return seq, results
+
+
+_GREY, _BLACK = 1, 2
+
+
+def _break_cycles(roots):
+    """
+    Cuts any cycle assembled by cross-branch subtree sharing.
+
+    Ancestor tracking stops a walk from following a reference back into
+    its own chain, but two objects that reference each other can each be
+    reached first by a path that never saw the other, and aliasing their
+    cached children lists then closes a loop no single path crossed.
+    Walk the finished lists depth-first and replace any children link
+    that points back into the walk's own open path with the same
+    "<recursive>" marker an ancestor cycle gets during the fetch.
+    """
+    color = {}
+    for root in roots:
+        if color.get(id(root)) == _BLACK:
+            continue
+        color[id(root)] = _GREY
+        stack = [(root, 0)]
+        while stack:
+            lst, i = stack.pop()
+            descended = False
+            while i < len(lst):
+                item = lst[i]
+                i += 1
+                children = item.children
+                if not children:
+                    continue
+                mark = color.get(id(children))
+                if mark == _GREY:
+                    # This link would close a loop; cut it here
+                    item.children = [_recursive_marker()]
+                elif mark != _BLACK:
+                    stack.append((lst, i))
+                    color[id(children)] = _GREY
+                    stack.append((children, 0))
+                    descended = True
+                    break
+            if not descended:
+                color[id(lst)] = _BLACK
+
+
+def _recursive_marker():
+    """Placeholder item shown where a cyclical reference was cut off."""
+    return Variable("<recursive>", "...", "recursive", None, 0)
+
+
+def dap_client(depth_limit: int, on_scope=None):
     """
     Example DAP client that:
       1. Connects to debugpy,
@@ -164,94 +604,54 @@ def dap_client(depth_limit: int):
       8. Returns a structure with all frames and scopes.
     """
 
-    print(f"Connecting to {HOST}:{PORT}...")
-    print(f"Depth limit: {depth_limit}")
-    sock = socket.create_connection((HOST, PORT))
-    sock.settimeout(10.0)
+    log.debug("Connecting to %s...", UNIX_SOCKET or "%s:%s" % (HOST, PORT))
+    log.debug("Depth limit: %s", depth_limit)
+    sock = _connect()
+    reader = DapReader(sock)
 
     seq = 1
 
     # 1) "initialize"
-    seq = send_dap_request(
-        sock,
-        seq,
-        "initialize",
-        {
-            "adapterID": "debugpy-test",
-            "pathFormat": "path",
-            "linesStartAt1": True,
-            "columnsStartAt1": True,
-            "supportsVariableType": True,
-            "supportsVariablePaging": True,
-            "supportsRunInTerminalRequest": False,
-        },
-    )
-    print("Sent 'initialize' request.")
+    seq = send_static_request(sock, seq, _INITIALIZE_TEMPLATE)
+    log.debug("Sent 'initialize' request.")
 
-    initialize_response = None
-    while not initialize_response:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "initialize":
-            initialize_response = msg
-            print("Got 'initialize' response, success:", msg.get("success"))
-        else:
-            print("Got message (before initialize response):", msg)
+    initialize_response = wait_for_response(reader, seq - 1)
+    log.debug("Got 'initialize' response, success: %s", initialize_response.get("success"))
 
     # 2) "attach"
-    seq = send_dap_request(sock, seq, "attach", {"subProcess": False})
-    print("Sent 'attach' request.")
+    seq = send_static_request(sock, seq, _ATTACH_TEMPLATE)
+    log.debug("Sent 'attach' request.")
 
     # 3) "configurationDone"
-    print("Sending 'configurationDone' request...")
-    seq = send_dap_request(sock, seq, "configurationDone")
-    print("Sent 'configurationDone' request.")
-
-    config_done_response = None
-    while not config_done_response:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "configurationDone":
-            config_done_response = msg
-            print("Got 'configurationDone' response, success:", msg.get("success"))
-        else:
-            print("Got message (waiting for configurationDone):", msg)
+    seq = send_static_request(sock, seq, _CONFIG_DONE_TEMPLATE)
+    log.debug("Sent 'configurationDone' request.")
+
+    config_done_response = wait_for_response(reader, seq - 1)
+    log.debug("Got 'configurationDone' response, success: %s", config_done_response.get("success"))
 
     # 4) "threads"
     seq = send_dap_request(sock, seq, "threads")
-    print("Sent 'threads' request.")
+    log.debug("Sent 'threads' request.")
 
-    threads_response = None
-    while not threads_response:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "threads":
-            threads_response = msg
-        else:
-            print("Got message (waiting for threads):", msg)
+    threads_response = wait_for_response(reader, seq - 1)
 
     threads_body = threads_response["body"]
     threads_list = threads_body.get("threads", [])
-    print(f"Threads: {threads_list}")
+    log.debug("Threads: %s", threads_list)
 
     if not threads_list:
-        print("No threads. Exiting.")
+        log.warning("No threads. Exiting.")
         sock.close()
         return {"frames": []}
 
     # Pause the first thread to ensure we can see meaningful variable data
     thread_id = threads_list[0]["id"]
-    print(f"Pausing thread {thread_id}...")
+    log.debug("Pausing thread %s...", thread_id)
 
     seq = send_dap_request(sock, seq, "pause", {"threadId": thread_id})
-    paused = False
-    while not paused:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "pause":
-            print("Got 'pause' response, success:", msg.get("success"))
-        elif msg.get("type") == "event" and msg.get("event") == "stopped":
-            reason = msg["body"].get("reason")
-            print(f"Thread is now paused (reason: {reason})")
-            paused = True
-        else:
-            print("Got message while waiting to pause:", msg)
+    stopped_event = wait_for_event(reader, "stopped")
+    reason = stopped_event["body"].get("reason")
+    log.debug("Thread is now paused (reason: %s)", reason)
 
     # 5) "stackTrace"
     seq = send_dap_request(
@@ -264,49 +664,59 @@ def dap_client(depth_limit: int):
             "levels": 50,  # raise if you suspect more frames
         },
     )
-    stack_trace_response = None
-    while not stack_trace_response:
-        msg = read_dap_message(sock)
-        if msg.get("type") == "response" and msg.get("command") == "stackTrace":
-            stack_trace_response = msg
-        else:
-            print("Got message (waiting for stackTrace):", msg)
+    stack_trace_response = wait_for_response(reader, seq - 1)
 
     frames_data = []
+    # Shared across scopes so a reference seen in both locals and globals
+    # is only fetched once
+    var_cache = {}
     frames = stack_trace_response["body"].get("stackFrames", [])
-    print(f"Found {len(frames)} frames in stackTrace.")
+    log.debug("Found %d frames in stackTrace.", len(frames))
 
     for frame_info in frames:
         frame_id = frame_info["id"]
         fn_name = frame_info["name"]
         source_path = frame_info.get("source", {}).get("path", "no_source")
-        print(f"Frame {frame_id}: {fn_name} @ {source_path}")
+        log.debug("Frame %s: %s @ %s", frame_id, fn_name, source_path)
 
         # 6) "scopes" for each frame
         seq = send_dap_request(sock, seq, "scopes", {"frameId": frame_id})
-        scopes_response = None
-        while not scopes_response:
-            msg = read_dap_message(sock)
-            if msg.get("type") == "response" and msg.get("command") == "scopes":
-                scopes_response = msg
-            else:
-                print("Got message (waiting for scopes):", msg)
+        scopes_response = wait_for_response(reader, seq - 1)
 
         scope_list = scopes_response["body"].get("scopes", [])
 
-        # We'll store all scopes in a dict keyed by scope name
-        scope_dict = {}
+        scope_names = []
+        scope_refs = []
         for scope_info in scope_list:
-            scope_name_original = scope_info["name"]
-            scope_name_lower = scope_name_original.lower()
-            scope_ref = scope_info["variablesReference"]
-            print(f"  Scope: {scope_name_original} (ref={scope_ref})")
+            log.debug(
+                "  Scope: %s (ref=%s)",
+                scope_info["name"],
+                scope_info["variablesReference"],
+            )
+            scope_names.append(scope_info["name"].lower())
+            scope_refs.append(scope_info["variablesReference"])
+
+        # Expand every scope of the frame in one merged walk, so e.g.
+        # locals and globals share round trips instead of paying for
+        # their levels back to back.
+        seq, var_trees = fetch_variable_trees(
+            reader, seq, scope_refs, depth=depth_limit, cache=var_cache
+        )
 
-            # Recursively expand variables in this scope
-            seq, var_tree = fetch_variable_tree(sock, seq, scope_ref, depth=depth_limit)
+        # We'll store all scopes in a dict keyed by scope name
+        scope_dict = {}
+        for scope_name_lower, var_tree in zip(scope_names, var_trees):
+            # Sort once here, where the data is produced, so re-renders
+            # never re-sort. attrgetter keeps the comparisons in C.
+            var_tree.sort(key=_by_name)
             # Store them under the scope name (lowercased or original, your choice)
             scope_dict[scope_name_lower] = var_tree
 
+            # Hand finished scopes to the caller frame by frame, so the
+            # UI can start rendering while later frames are still fetching
+            if on_scope is not None:
+                on_scope(scope_name_lower, var_tree)
+
         frames_data.append(
             {
                 "id": frame_id,
@@ -316,14 +726,14 @@ def dap_client(depth_limit: int):
             }
         )
 
-    print("Done collecting variables. Closing socket.")
+    log.debug("Done collecting variables. Closing socket.")
     sock.close()
 
     # Remove globals scope if exactly the same as locals
     for frame in frames_data:
         if "globals" in frame["scopes"]:
             if len(frame["scopes"]["globals"]) == len(frame["scopes"]["locals"]):
-                print(f"Removing 'globals' scope as it's the same length as 'locals'")
+                log.debug("Removing 'globals' scope as it's the same length as 'locals'")
                 del frame["scopes"]["globals"]
 
     # Return everything
@@ -331,6 +741,11 @@ def dap_client(depth_limit: int):
 
 
 if __name__ == "__main__":
+    # Show progress when run directly; as a library the caller decides
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     result = dap_client(depth_limit=2)
-    print("\n=== Final Expanded Frames ===\n")
-    print(json.dumps(result, indent=2))
+    sys.stderr.write("\n=== Final Expanded Frames ===\n\n")
+    # Stream straight to stdout rather than building the whole indented
+    # string in memory first; big trees serialize to many megabytes
+    json.dump(result, sys.stdout, indent=2, default=Variable.as_dict)
+    sys.stdout.write("\n")
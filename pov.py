@@ -1,95 +1,181 @@
 import hyperdiv as hd
+import logging
+from contextlib import ExitStack
+from dataclasses import dataclass, field
 from dap_client import *
 
 
-# Variables to filter out from the display
-## These tend to be boilerplate or internal variables that are not interesting to display
-VARIABLE_NAMES_TO_FILTER = [
-    "__builtins__",
-    "__doc__",
-    "__loader__",
-    "__name__",
-    "__package__",
-    "__spec__",
-    "special variables",
-    "function variables",
-    "module variables",
-    "class variables",
-    "debugpy",
-]
-VARIABLE_TYPES_TO_FILTER = [
-    "builtin_function_or_method",
-    "method-wrapper",
-]
+# VARIABLE_NAMES_TO_FILTER / VARIABLE_TYPES_TO_FILTER now live in
+# dap_client (star-imported above), so filtered variables are dropped
+# before they are even fetched.
+
+log = logging.getLogger(__name__)
+
+# How many top-level rows a scope renders before hiding the rest behind
+# a "show more" button. Keeps the initial DOM (and hyperdiv's diff work)
+# proportional to what fits on screen instead of the whole snapshot.
+VISIBLE_WINDOW = 100
+
+
+@dataclass(slots=True)
+class RenderNode:
+    """A variable prepared for display: filters and fallbacks applied."""
+
+    name: str
+    value: str
+    type: str
+    evaluate_name: str
+    ref: int
+    type_label: str = ""
+    eval_label: str = ""
+    children: list = field(default_factory=list)
+
+
+def normalize_tree(variables, _active=None):
+    """
+    Walks a fetched variable tree once and prepares it for rendering:
+    applies the name/type filters, fills in fallback values and
+    truncates long ones. Rendering is then a pure tree walk with no
+    per-node munging on every Hyperdiv re-render.
+
+    '_active' tracks the children lists on the current walk path; the
+    fetch is expected to deliver acyclic trees, but a cycle that slips
+    through is cut here rather than recursing to death.
+    """
+    if _active is None:
+        _active = set()
+    nodes = []
+    for v in variables:
+        # The fetch already filters, but results from older sessions or
+        # markers can still carry filtered names/types
+        if v.name in VARIABLE_NAMES_TO_FILTER or v.type in VARIABLE_TYPES_TO_FILTER:
+            continue
+
+        # Truncate long values. Plain concatenation beats an f-string for
+        # these two-piece joins, and this runs once per node.
+        value = v.value or "unknown"
+        if len(value) > 100:
+            value = value[:100] + " ..."
+
+        vtype = v.type or "unknown"
+        evaluate_name = v.evaluateName or ""
+
+        # Most nodes are leaves; skip the recursive call for them
+        if v.children and id(v.children) not in _active:
+            _active.add(id(v.children))
+            child_nodes = normalize_tree(v.children, _active)
+            _active.discard(id(v.children))
+        else:
+            child_nodes = []
+
+        nodes.append(
+            RenderNode(
+                v.name,
+                value,
+                vtype,
+                evaluate_name,
+                v.variablesReference,
+                "(" + vtype + ")",
+                evaluate_name if evaluate_name and evaluate_name != v.name else "",
+                child_nodes,
+            )
+        )
+    return nodes
+
+
+# Normalized trees, keyed by the identity of the fetched scope list.
+# pov() re-runs on every hyperdiv state change with the same task result,
+# so this makes normalization a one-time cost per snapshot. Keeping the
+# source list in the value pins it, so an id() can't be recycled while
+# its cache entry is alive.
+_normalize_cache = {}
+
+
+def normalize_tree_cached(variables):
+    hit = _normalize_cache.get(id(variables))
+    if hit is not None and hit[0] is variables:
+        return hit[1]
+    if len(_normalize_cache) > 8:
+        _normalize_cache.clear()
+    nodes = normalize_tree(variables)
+    _normalize_cache[id(variables)] = (variables, nodes)
+    return nodes
 
 
 def render_tree(variables, title):
+    window = hd.state(rows=VISIBLE_WINDOW)
     with hd.box(border="0px solid blue", padding=0.8):
         with hd.tree(indent_guide_width="1px"):
-            render_variable_tree(variables)
+            render_variable_tree(variables[: window.rows])
+        remaining = len(variables) - window.rows
+        if remaining > 0:
+            if hd.button(f"Show {remaining} more...").clicked:
+                window.rows += VISIBLE_WINDOW
 
 
 def render_variable_tree(variables):
     """
-    Renders a list of variables (each may have 'children') in a nested tree format.
+    Renders a list of normalized variables (each may have 'children') in
+    a nested tree format.
+
+    The walk is an explicit stack rather than recursion, so deep trees
+    cost one loop iteration per node instead of a Python call frame per
+    level. Ancestor tree_item/scope contexts are held open in ExitStacks
+    until the walk moves back above their depth, which reproduces the
+    nesting the recursive version got for free.
     """
-    print(f"Rendering variable tree with {len(variables)} variables")
-    for v in variables:
-        # print(f"Rendering variable tree for: {v}")
-        name = v["name"]
-        value = v.get("value", "unknown")
-        var_type = v.get("type", "unknown")
-        evaluate_name = v.get("evaluateName", "")
-        children = v.get("children", [])
-
-        # Filter out certain variable names
-        if name in VARIABLE_NAMES_TO_FILTER:
-            continue
-        # Filter out certain variable types
-        if var_type in VARIABLE_TYPES_TO_FILTER:
-            continue
+    log.debug("Rendering variable tree with %d variables", len(variables))
+    stack = [(v, 0) for v in reversed(variables)]
+    open_items = []  # one ExitStack per currently-open ancestor row
+    try:
+        while stack:
+            v, depth = stack.pop()
+            while len(open_items) > depth:
+                open_items.pop().close()
 
-        # Truncate long values
-        if len(value) > 100:
-            value = f"{value[:100]} ..."
-
-        bg_color = None
-        # TODO: Find a better way to color code variables / style them based on type
-        # col_varient = "-800"
-        # if var_type == "str":
-        #     bg_color = f"sky{col_varient}"
-        # if var_type == "int":
-        #     bg_color = f"violet{col_varient}"
-        # if var_type == "float":
-        #     bg_color = f"purple{col_varient}"
-        # if var_type == "list":
-        #     bg_color = f"pink{col_varient}"
-        # if var_type == "dict":
-        #     bg_color = f"rose{col_varient}"
-
-        # Render one node for the variable
-        with hd.scope(v):
-            # print(f"DEBUG: Rendering variable: {name} with value: {value}")
-            with hd.tree_item(background_color=bg_color):
-                # hd.markdown(f"**{name}**")
-                # hd.markdown(f"{name}")
-                # hd.markdown(f"`{value}`")
-                # hd.markdown(f"`{var_type}`")
-                # hd.markdown(f"`{evaluate_name}`")
-                # hd.markdown(f"`{v.get('variablesReference', 0)}`")
-
-                hd.markdown(f"**{name}**: `{value}` (**Type**: `{var_type}`) ")
-                if name != evaluate_name and evaluate_name:
-                    hd.markdown(" &nbsp;&nbsp;&nbsp;  ")
-                    # hd.markdown(f" **Evaluate Name**: `{evaluate_name}`")
-                    hd.markdown(f" | `{evaluate_name}`")
-                    # hd.markdown(
-                    #     f" **Variables Reference**: `{v.get('variablesReference', 0)}`"
-                    # )
-
-                # If this variable has child variables, recurse
-                if children:
-                    render_variable_tree(children)
+            # Keying the scope on the row's content (rather than object
+            # identity) means an unchanged variable produces the same
+            # virtual key across snapshots, so hyperdiv's own diffing can
+            # skip it instead of re-creating the row.
+            item = ExitStack()
+            item.enter_context(hd.scope((v.ref, v.name, v.value, v.type)))
+            # TODO: Find a better way to color code variables / style them based on type
+            row = item.enter_context(hd.tree_item())
+
+            # Plain text primitives instead of hd.markdown: these rows
+            # only need bold/mono styling, not a Markdown parse per node
+            with hd.hbox(gap=0.4, align="center"):
+                hd.text(v.name, font_weight="bold")
+                hd.text(v.value, font_family="mono")
+                hd.text(v.type_label, font_family="mono", font_color="neutral-600")
+                if v.eval_label:
+                    hd.text("|", font_color="neutral-400")
+                    hd.text(v.eval_label, font_family="mono", font_color="neutral-600")
+
+            # ref == 0 is DAP's "no children"; the int test short-circuits
+            # before the list is even looked at for the common leaf case
+            if v.ref and v.children:
+                if row.expanded:
+                    # Leave this row's contexts open so its children nest inside
+                    open_items.append(item)
+                    for child in reversed(v.children):
+                        stack.append((child, depth + 1))
+                else:
+                    # Collapsed: emit one stub child so the expand chevron
+                    # shows, and defer the real subtree until it's opened.
+                    # Keeps the initial DOM at O(visible rows) even though
+                    # the data is already fetched.
+                    with hd.tree_item():
+                        hd.text(
+                            f"{len(v.children)} ...",
+                            font_color="neutral-500",
+                        )
+                    item.close()
+            else:
+                item.close()
+    finally:
+        while open_items:
+            open_items.pop().close()
 
 
 def pov():
@@ -105,9 +191,19 @@ def pov():
             hd.divider(spacing=0.4, thickness=0)
 
             dap_task = hd.task()
-            dap_task.run(
-                lambda: dap_client(depth_limit=2)
-            )  # TODO: make this a dropdown/similar
+            # Scopes stream in here as the client finishes each one, so we
+            # can render early results while the rest is still fetching
+            stream = hd.state(scopes=None)
+
+            def collect():
+                def on_scope(name, tree):
+                    done = dict(stream.scopes or {})
+                    done[name] = tree
+                    stream.scopes = done
+
+                return dap_client(depth_limit=2, on_scope=on_scope)
+
+            dap_task.run(collect)  # TODO: make this a dropdown/similar
 
             if dap_task.running:
                 hd.markdown("### Waiting for variables...")
@@ -119,6 +215,16 @@ def pov():
                     "This can take a couple of minutes, depending on the size of your program."
                 )
 
+                # Show whatever scopes have already arrived
+                if stream.scopes:
+                    for scope_name in stream.scopes.keys():
+                        with hd.scope(scope_name):
+                            hd.markdown(f"#### {scope_name.title()} Scope")
+                            render_tree(
+                                normalize_tree_cached(stream.scopes[scope_name]),
+                                title=f"{scope_name.title()} Scope",
+                            )
+
             if dap_task.error:
                 hd.markdown(
                     "`Error collecting variables - make sure the debugger is running on localhost:5678`"
@@ -126,27 +232,31 @@ def pov():
                 return
 
             if dap_task.done:
-                print("dap_task is done")
+                log.debug("dap_task is done")
                 results = dap_task.result  # This is the dict returned by dap_client()
 
-                # If no frames, nothing to display
-                frames = results.get("frames", [])
+                # If no frames, nothing to display. dap_client always
+                # returns a "frames" list, so index it directly.
+                frames = results["frames"]
                 if not frames:
-                    print("No frames returned from dap_client. Re-running.")
+                    log.debug("No frames returned from dap_client. Re-running.")
                     dap_task.clear()
                     dap_task.run(dap_client)
                     return
 
                 # Right now we only get one frame, so we'll just use that
                 first_frame = frames[0]
-                dap_scopes = first_frame.get("scopes", {})
-                print(f"Scopes available: {list(dap_scopes.keys())}")
+                dap_scopes = first_frame["scopes"]
+                log.debug("Scopes available: %s", list(dap_scopes.keys()))
 
                 # Count variables in each scope
-                for scope_list in dap_scopes.keys():
-                    print(
-                        f"Scope: {scope_list} has {len(dap_scopes[scope_list])} variables"
-                    )
+                if log.isEnabledFor(logging.DEBUG):
+                    for scope_list in dap_scopes.keys():
+                        log.debug(
+                            "Scope: %s has %d variables",
+                            scope_list,
+                            len(dap_scopes[scope_list]),
+                        )
 
                 # Create a tab group for all scope names
                 tabs_dict = {}
@@ -164,7 +274,9 @@ def pov():
                     for scope_name, tab_obj in tabs_dict.items():
                         with hd.scope(tab_obj):
                             if tab_obj.active:
-                                scope_vars = dap_scopes[scope_name]
+                                scope_vars = normalize_tree_cached(
+                                    dap_scopes[scope_name]
+                                )
                                 render_tree(
                                     scope_vars, title=f"{scope_name.title()} Scope"
                                 )